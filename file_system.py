@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
 import os
+import atexit
+import functools
 import json
-import math
+import mmap
+import pickle
+import re
+import shlex
+import struct
+import sys
+from array import array
 
 # ----------------------------
 # Quick testing checklist
@@ -42,34 +50,117 @@ import math
 # ----------------------------
 
 DISK_FILE = "virtual_disk.bin"
-META_FILE = "metadata.json"
+META_FILE = "metadata.bin"
+META_VERSION = 2  # metadata.json, the JSON layout before it, had no version field
+LEGACY_META_FILE = "metadata.json"
+JOURNAL_FILE = META_FILE + ".log"
+META_TMP_FILE = META_FILE + ".tmp"
+JOURNAL_HEADER = struct.Struct("<IQ")  # payload length, sequence number
 
 DISK_SIZE = 1024 * 1024   # 1 MB RAM disk
 BLOCK_SIZE = 512
 NUM_BLOCKS = DISK_SIZE // BLOCK_SIZE
+FREE_MAP_BYTES = NUM_BLOCKS // 8
+GROUP_BLOCKS = 512  # blocks covered by one summary bit (64 bytes of the free map)
+GROUP_BYTES = GROUP_BLOCKS // 8
+NUM_GROUPS = NUM_BLOCKS // GROUP_BLOCKS
+ALL_GROUPS = (1 << NUM_GROUPS) - 1
+
+CHECKPOINT_EVERY = 128  # journaled mutations between full metadata saves
+
+# one shared zero buffer; zero-fills slice it instead of allocating
+_ZEROS = memoryview(bytes(DISK_SIZE))
+
+
+@functools.lru_cache(maxsize=256)
+def _split_path(path):
+    """Split a path string into (is_absolute, parts); pure, so memoized."""
+    return path.startswith("/"), tuple(p for p in path.split("/") if p)
+
+
+# a word is a whole "quoted" or 'quoted' string, or any run of non-spaces
+_WORD = re.compile(r'"([^"]*)"(?=\s|$)|\'([^\']*)\'(?=\s|$)|(\S+)')
+
+
+def _split_command(line, maxsplit=-1):
+    """Split a command line into words, treating a fully quoted word as one.
+
+    Like str.split, at most maxsplit splits are made and the rest of the
+    line is kept as typed. A quote inside a word (it's.txt) is literal.
+    """
+    words = []
+    for m in _WORD.finditer(line):
+        if len(words) == maxsplit:
+            words.append(line[m.start():])
+            return words
+        words.append(next(g for g in m.groups() if g is not None))
+    return words
+
+
+def _unquote_text(text):
+    """Strip the quotes from write text that is one quoted token; leave anything else as typed."""
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        try:
+            (text,) = shlex.split(text)
+        except ValueError:
+            pass  # unbalanced, or several tokens: keep the raw text
+    return text
 
 
 class FileSystem:
-    def __init__(self):
-        self.root = {"name": "/", "type": "dir", "children": {}}
+    def __init__(self, batch_mode=False):
+        self.root = {"name": "/", "type": "dir", "dirs": {}, "files": {}}
         self.current_path = []
+        self._cwd_nodes = [self.root]  # root .. cwd, one node per current_path part
 
-        self.free_map = [True] * NUM_BLOCKS
-        self.fat = [-2] * NUM_BLOCKS  # -2 free, -1 EOF
+        self.free_map = bytearray(b"\xff" * FREE_MAP_BYTES)  # bit set = free (derived from fat)
+        self._free_count = NUM_BLOCKS
+        self._next_free = 0  # no free block below this index
+        self._summary = ALL_GROUPS  # bit g set = group g has a free block
+        self.fat = array("i", [-2]) * NUM_BLOCKS  # -2 free, -1 EOF
 
         self.open_file_table = {}
 
-        # RAM-backed disk space
+        # basename -> [(full_path, type)], derived from the tree (not saved)
+        self._name_index = {}
+
+        # RAM-backed disk space (memory-mapped onto DISK_FILE by init_filesystem)
         self._disk_mem = bytearray(DISK_SIZE)
+        self._mv = memoryview(self._disk_mem)  # shared view for block slicing
+        self._disk_fd = None
+        self._meta_fd = None
+
+        # write-behind bookkeeping
+        self._batch_mode = batch_mode  # scripted input: save once at the end
+        self._journal = None
+        self._seq = 0  # number of the last journaled mutation
+        self._dirty = False
+        self._ops_since_flush = 0
+        self._dirty_blocks = set()
+        # batch mode: blocks freed since the last checkpoint, which may still
+        # hold checkpointed data and so are not reused until the next save
+        self._pending_free = []
 
     # ---------- startup / save ----------
 
     def init_filesystem(self):
         """Load previous state if present; otherwise start fresh."""
-        self._load_disk_image_if_exists()
-
-        if os.path.exists(META_FILE):
+        self._disk_fd = os.open(DISK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self._disk_fd, DISK_SIZE)
+        self._disk_mem = mmap.mmap(self._disk_fd, DISK_SIZE, access=mmap.ACCESS_WRITE)
+        self._mv = memoryview(self._disk_mem)
+        self._meta_fd = os.open(META_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        self._journal = open(JOURNAL_FILE, "ab")
+        atexit.register(self.shutdown)
+
+        if os.fstat(self._meta_fd).st_size > 0:
             self._load_metadata()
+            if self._replay_journal():
+                self._save_state()
+        elif os.path.exists(LEGACY_META_FILE):
+            self._load_legacy_metadata()
+            self._save_state()
+            os.remove(LEGACY_META_FILE)  # its contents now live in META_FILE
         else:
             self._reset_fresh_state()
             self._save_state()
@@ -77,179 +168,585 @@ class FileSystem:
         print("File system initialized (RAM disk).")
 
     def shutdown(self):
-        """Final save on exit."""
-        self._save_state()
+        """Final save on exit (safe to call more than once)."""
+        if self._disk_fd is None:
+            return
+        self._flush_if_needed()
+        self._journal.close()
+        self._mv.release()  # the mapping can't close while a view is exported
+        self._disk_mem.close()
+        for fd in (self._meta_fd, self._disk_fd):
+            os.fsync(fd)
+            os.close(fd)
+        self._meta_fd = None
+        self._disk_fd = None
 
     def _reset_fresh_state(self):
         """Reset to a brand-new empty filesystem."""
-        self.root = {"name": "/", "type": "dir", "children": {}}
+        self.root = {"name": "/", "type": "dir", "dirs": {}, "files": {}}
         self.current_path = []
-        self.free_map = [True] * NUM_BLOCKS
-        self.fat = [-2] * NUM_BLOCKS
+        self._cwd_nodes = [self.root]
+        self.free_map = bytearray(b"\xff" * FREE_MAP_BYTES)
+        self._free_count = NUM_BLOCKS
+        self._next_free = 0
+        self._summary = ALL_GROUPS
+        self.fat = array("i", [-2]) * NUM_BLOCKS
         self.open_file_table = {}
-        self._disk_mem = bytearray(DISK_SIZE)
+        self._name_index = {}
+        self._seq = 0
+        self._pending_free = []
+        self._disk_mem[:] = _ZEROS
+        self._dirty_blocks = set(range(NUM_BLOCKS))
 
     def _save_state(self):
-        """Save metadata + RAM snapshot."""
-        self._save_metadata()
+        """Checkpoint: save RAM snapshot + metadata, then empty the journal."""
+        if self._pending_free:
+            self._release_blocks(self._pending_free)
+            self._pending_free = []
         self._save_disk_image()
+        self._save_metadata()
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._dirty = False
+        self._ops_since_flush = 0
+
+    def _log_op(self, op, *args):
+        """Journal one mutation; checkpoint every CHECKPOINT_EVERY of them."""
+        self._seq += 1
+        self._dirty = True
+        if self._batch_mode:
+            return  # nothing is written until the script ends
+
+        payload = pickle.dumps((op,) + args, protocol=pickle.HIGHEST_PROTOCOL)
+        self._journal.write(JOURNAL_HEADER.pack(len(payload), self._seq) + payload)
+        self._journal.flush()
+
+        self._ops_since_flush += 1
+        if self._ops_since_flush >= CHECKPOINT_EVERY:
+            self._flush_if_needed()
+
+    def _replay_journal(self):
+        """Re-apply journaled mutations newer than the checkpoint; return how many."""
+        # replayed frees are already journaled, so even a batch-mode start
+        # releases them at once instead of deferring them to the next save
+        batch_mode, self._batch_mode = self._batch_mode, False
+        applied = 0
+        good = 0  # end of the last complete record
+        try:
+            with open(JOURNAL_FILE, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                while True:
+                    header = f.read(JOURNAL_HEADER.size)
+                    if len(header) < JOURNAL_HEADER.size:
+                        break  # end of the log, or a torn header
+                    length, seq = JOURNAL_HEADER.unpack(header)
+                    if f.tell() + length > size:
+                        break  # torn final record
+
+                    if seq <= self._seq:
+                        f.seek(length, os.SEEK_CUR)  # already in the checkpoint
+                    else:
+                        op, *args = pickle.loads(f.read(length))
+                        self._apply_op(op, args)
+                        self._seq = seq
+                        applied += 1
+                    good = f.tell()
+        finally:
+            self._batch_mode = batch_mode
+
+        if good < size:
+            # cut the torn tail so new records don't land after it
+            self._journal.truncate(good)
+        return applied
+
+    def _apply_op(self, op, args):
+        """Apply one journal record to the tree and FAT."""
+        if op in ("mkdir", "create"):
+            (parts,) = args
+            self._add_node(self._node_at(parts[:-1]), parts, "dir" if op == "mkdir" else "file")
+        elif op == "write":
+            parts, size, appended = args
+            entry = self._node_at(parts)
+            if appended:
+                tail = self._get_block_chain(entry["first_block"])
+                self._claim_chain(appended)
+                if tail:
+                    self.fat[tail[-1]] = appended[0]
+                else:
+                    entry["first_block"] = appended[0]
+            entry["size"] = size
+        elif op == "delete":
+            (parts,) = args
+            self._remove_node(self._node_at(parts[:-1]), parts)
+        elif op == "mv":
+            src_parts, dest_parts = args
+            self._move_node(self._node_at(src_parts[:-1]), src_parts,
+                            self._node_at(dest_parts[:-1]), dest_parts)
+        else:
+            raise ValueError(f"Unknown journal op '{op}'.")
+
+    def _flush_if_needed(self):
+        """Save state only if something changed since the last save."""
+        if self._dirty or self._dirty_blocks:
+            self._save_state()
 
     def _save_metadata(self):
-        """Save directory tree + FAT + free map."""
+        """Save directory tree + FAT (binary pickle); the free map is derived from the FAT."""
         meta = {
+            "version": META_VERSION,
+            "seq": self._seq,
             "block_size": BLOCK_SIZE,
             "num_blocks": NUM_BLOCKS,
             "root": self.root,
-            "free_map": self.free_map,
-            "fat": self.fat,
+            # raw blob instead of 2048 separate small ints
+            "fat": self.fat.tobytes(),
         }
-        with open(META_FILE, "w", encoding="utf-8") as f:
-            json.dump(meta, f, indent=2)
+        payload = pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # write a new file and rename it over the old one, so a crash mid-save
+        # leaves the previous checkpoint whole (the journal is emptied next)
+        fd = os.open(META_TMP_FILE, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.pwrite(fd, payload, 0)
+        os.fsync(fd)
+        os.replace(META_TMP_FILE, META_FILE)
+        os.close(self._meta_fd)
+        self._meta_fd = fd  # now the descriptor of META_FILE
 
     def _load_metadata(self):
-        """Load directory tree + FAT + free map."""
-        with open(META_FILE, "r", encoding="utf-8") as f:
-            meta = json.load(f)
+        """Load directory tree + FAT and rebuild the free map from it."""
+        size = os.fstat(self._meta_fd).st_size
+        meta = pickle.loads(os.pread(self._meta_fd, size, 0))  # one read, then decode from memory
 
+        if meta.get("version") != META_VERSION:
+            raise ValueError("Unsupported metadata version.")
         if meta.get("block_size") != BLOCK_SIZE:
             raise ValueError("Block size mismatch with metadata.")
 
-        self.root = meta.get("root", {"name": "/", "type": "dir", "children": {}})
-        self.free_map = meta.get("free_map", [True] * NUM_BLOCKS)
-        self.fat = meta.get("fat", [-2] * NUM_BLOCKS)
+        self.root = meta.get("root", {"name": "/", "type": "dir", "dirs": {}, "files": {}})
+        self._seq = meta.get("seq", 0)
+        self._cwd_nodes = self._nodes_along(self.current_path)
 
-    def _save_disk_image(self):
-        """Snapshot the RAM disk for persistence."""
-        with open(DISK_FILE, "wb") as f:
-            f.write(self._disk_mem)
-
-    def _load_disk_image_if_exists(self):
-        """Load the last RAM snapshot if present."""
-        if not os.path.exists(DISK_FILE):
-            self._disk_mem = bytearray(DISK_SIZE)
-            return
+        fat = meta.get("fat")
+        if fat:
+            self.fat = array("i")
+            self.fat.frombytes(fat)
+            if len(self.fat) != NUM_BLOCKS:
+                raise ValueError("FAT size mismatch with metadata.")
+        else:
+            self.fat = array("i", [-2]) * NUM_BLOCKS
 
-        with open(DISK_FILE, "rb") as f:
-            data = f.read()
+        self._rebuild_free_map()
+        self._rebuild_name_index()
 
-        if len(data) < DISK_SIZE:
-            data += b"\x00" * (DISK_SIZE - len(data))
-        else:
-            data = data[:DISK_SIZE]
+    def _load_legacy_metadata(self):
+        """Convert an old metadata.json (single children dict, FAT as a list) to the current layout."""
+        with open(LEGACY_META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
 
-        self._disk_mem = bytearray(data)
+        if meta.get("block_size") != BLOCK_SIZE:
+            raise ValueError("Block size mismatch with metadata.")
+
+        def convert(node):
+            if node["type"] == "file":
+                return node
+            dirs, files = {}, {}
+            for name, child in node["children"].items():
+                (dirs if child["type"] == "dir" else files)[name] = convert(child)
+            return {"name": node["name"], "type": "dir", "dirs": dirs, "files": files}
+
+        self.root = convert(meta.get("root", {"name": "/", "type": "dir", "children": {}}))
+        self._cwd_nodes = self._nodes_along(self.current_path)
+        self.fat = array("i", meta.get("fat", [-2] * NUM_BLOCKS))
+        if len(self.fat) != NUM_BLOCKS:
+            raise ValueError("FAT size mismatch with metadata.")
+
+        self._rebuild_free_map()
+        self._rebuild_name_index()
+
+    def _rebuild_free_map(self):
+        """Derive the free bitmap and free count from the FAT (-2 = free)."""
+        free_map = bytearray(FREE_MAP_BYTES)
+        for i, nxt in enumerate(self.fat):
+            if nxt == -2:
+                free_map[i >> 3] |= 1 << (i & 7)
+        self.free_map = free_map
+        self._free_count = self.fat.count(-2)
+        self._next_free = self.fat.index(-2) if self._free_count else NUM_BLOCKS
+        self._summary = 0
+        for g in range(NUM_GROUPS):
+            if any(free_map[g * GROUP_BYTES:(g + 1) * GROUP_BYTES]):
+                self._summary |= 1 << g
+
+    def _save_disk_image(self):
+        """Flush only the changed pages of the memory-mapped disk file."""
+        page = mmap.ALLOCATIONGRANULARITY  # flush offsets must be aligned to this
+        dirty_pages = {b * BLOCK_SIZE // page for b in self._dirty_blocks}
+        for start, end in self._contiguous_runs(dirty_pages):
+            offset = start * page
+            self._disk_mem.flush(offset, min(end * page, DISK_SIZE) - offset)
+        self._dirty_blocks.clear()
 
     # ---------- path helpers ----------
 
     def _get_current_dir_node(self):
         """Return the directory node for the current working directory."""
-        node = self.root
-        for part in self.current_path:
-            node = node["children"][part]
-        return node
+        return self._cwd_nodes[-1]
 
     def _resolve_path(self, path):
         """Lightweight path resolver mainly used by mv."""
-        parts = path.strip("/").split("/") if path != "/" else []
+        is_abs, parts = _split_path(path)
 
-        if path.startswith("/"):
+        if is_abs:
             node = self.root
             if not parts:
                 return None, "/"
         else:
             node = self._get_current_dir_node()
-            if path == "" or path == ".":
+            if not parts or path == ".":
                 return None, "."
 
         for part in parts[:-1]:
-            if part in node["children"] and node["children"][part]["type"] == "dir":
-                node = node["children"][part]
+            if part in node["dirs"]:
+                node = node["dirs"][part]
             else:
                 return None, None
 
         target_name = parts[-1] if parts else ""
         return node, target_name
 
+    def _abs_parts(self, path):
+        """Absolute path components of a path string, as _resolve_path reads it."""
+        is_abs, parts = _split_path(path)
+        if is_abs:
+            return list(parts)
+        return self.current_path + list(parts)
+
+    def _join_path(self, parts):
+        """Turn path components into an absolute path string."""
+        return "/" + "/".join(parts)
+
+    def _nodes_along(self, parts):
+        """Return the nodes from the root down to absolute path components."""
+        nodes = [self.root]
+        for part in parts:
+            nodes.append(nodes[-1]["dirs"][part])
+        return nodes
+
+    def _node_at(self, parts):
+        """Return the node at absolute path components."""
+        node = self.root
+        for part in parts[:-1]:
+            node = node["dirs"][part]
+        if parts:
+            name = parts[-1]
+            node = node["files"][name] if name in node["files"] else node["dirs"][name]
+        return node
+
+    # ---------- tree mutations (shared with journal replay) ----------
+
+    def _add_node(self, parent, parts, node_type):
+        """Create an empty dir or file at parts under parent."""
+        name = parts[-1]
+        if node_type == "dir":
+            node = {
+                "name": name,
+                "type": "dir",
+                "dirs": {},
+                "files": {}
+            }
+        else:
+            node = {
+                "name": name,
+                "type": "file",
+                "size": 0,
+                "first_block": -1
+            }
+        parent["dirs" if node_type == "dir" else "files"][name] = node
+        self._index_add(name, self._join_path(parts), node_type)
+
+    def _remove_node(self, parent, parts):
+        """Unlink a file or empty dir, releasing a file's blocks."""
+        files = parent["files"]
+        entry = files.pop(parts[-1]) if parts[-1] in files else parent["dirs"].pop(parts[-1])
+        if entry["type"] == "file" and entry["first_block"] != -1:
+            self._free_chain(entry["first_block"])
+        self._index_remove(parts[-1], self._join_path(parts), entry["type"])
+
+    def _move_node(self, src_parent, src_parts, dest_dir, dest_parts):
+        """Move a node from src_parts to dest_parts, re-indexing its subtree."""
+        files = src_parent["files"]
+        entry = files.pop(src_parts[-1]) if src_parts[-1] in files else src_parent["dirs"].pop(src_parts[-1])
+        for name, path, node_type in self._walk(entry, self._join_path(src_parts)):
+            self._index_remove(name, path, node_type)
+
+        entry["name"] = dest_parts[-1]
+        dest_dir["dirs" if entry["type"] == "dir" else "files"][dest_parts[-1]] = entry
+        for name, path, node_type in self._walk(entry, self._join_path(dest_parts)):
+            self._index_add(name, path, node_type)
+
+        # the cwd and files open below a moved directory now live elsewhere
+        depth = len(src_parts)
+        if self.current_path[:depth] == src_parts:
+            self.current_path = dest_parts + self.current_path[depth:]
+            self._cwd_nodes = self._nodes_along(self.current_path)
+        for rec in self.open_file_table.values():
+            if rec["parts"][:depth] == src_parts:
+                rec["parts"] = dest_parts + rec["parts"][depth:]
+
+    # ---------- name index ----------
+
+    def _walk(self, node, path):
+        """Yield (name, path, type) for node and everything below it, pre-order."""
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            yield node["name"], path, node["type"]
+            if node["type"] == "dir":
+                prefix = path if path != "/" else ""
+                # reversed so dirs, then files, come off the stack in insertion order
+                stack.extend((child, f"{prefix}/{child_name}")
+                             for child_name, child in reversed(node["files"].items()))
+                stack.extend((child, f"{prefix}/{child_name}")
+                             for child_name, child in reversed(node["dirs"].items()))
+
+    def _index_add(self, name, path, node_type):
+        """Record a new path under its basename."""
+        self._name_index.setdefault(name, []).append((path, node_type))
+
+    def _index_remove(self, name, path, node_type):
+        """Drop a path from its basename's entry."""
+        matches = self._name_index.get(name)
+        if matches is None:
+            return
+        matches.remove((path, node_type))
+        if not matches:
+            del self._name_index[name]
+
+    def _rebuild_name_index(self):
+        """Rebuild the search index from the tree (one pass at startup)."""
+        self._name_index = {}
+        for name, path, node_type in self._walk(self.root, "/"):
+            if path != "/":
+                self._index_add(name, path, node_type)
+
     # ---------- block + FAT helpers ----------
 
+    def _is_free(self, b):
+        """Check block b's bit in the free map."""
+        return self.free_map[b >> 3] >> (b & 7) & 1
+
+    def _mark_used(self, b):
+        """Clear block b's bit in the free map (and its group's, if now full)."""
+        free_map = self.free_map
+        free_map[b >> 3] &= ~(1 << (b & 7))
+        if not free_map[b >> 3]:
+            g = b // GROUP_BLOCKS
+            if not any(free_map[g * GROUP_BYTES:(g + 1) * GROUP_BYTES]):
+                self._summary &= ~(1 << g)
+
+    def _mark_free(self, b):
+        """Set block b's bit in the free map and its group's summary bit."""
+        self.free_map[b >> 3] |= 1 << (b & 7)
+        self._summary |= 1 << (b // GROUP_BLOCKS)
+
+    def _find_free(self, n):
+        """Return up to n of the lowest free blocks.
+
+        The summary bitmap picks the groups that still have a free block;
+        only those are scanned, 64 bits at a time.
+        """
+        free_map = self.free_map
+        found = []
+        hint_word = (self._next_free >> 6) * 8
+        groups = self._summary & ~((1 << (self._next_free // GROUP_BLOCKS)) - 1)
+        while groups:
+            lsb = groups & -groups  # lowest group with a free block
+            g = lsb.bit_length() - 1
+            groups ^= lsb
+
+            first = g * GROUP_BYTES
+            for i in range(max(first, hint_word), first + GROUP_BYTES, 8):
+                word = int.from_bytes(free_map[i:i + 8], "little")
+                while word:
+                    bit = word & -word  # lowest free bit in this word
+                    found.append(i * 8 + bit.bit_length() - 1)
+                    if len(found) == n:
+                        return found
+                    word ^= bit
+        return found
+
+    def _find_free_run(self, n):
+        """Return the first run of n adjacent free blocks, or None if there is none."""
+        if n <= 0:
+            return None
+
+        # no run starts below the hint or in a full group, so the scan
+        # begins at the first group at or above the hint with a free block
+        groups = self._summary & ~((1 << (self._next_free // GROUP_BLOCKS)) - 1)
+        if not groups:
+            return None
+        g = (groups & -groups).bit_length() - 1
+        first = max(self._next_free >> 3, g * GROUP_BYTES)
+
+        # bit p of runs survives only if bits p..p+n-1 are all free
+        runs = int.from_bytes(self.free_map[first:], "little")
+        width = 1
+        while width < n and runs:
+            step = min(width, n - width)
+            runs &= runs >> step
+            width += step
+        if not runs:
+            return None
+
+        start = first * 8 + (runs & -runs).bit_length() - 1
+        return list(range(start, start + n))
+
+    def _reclaim_pending(self, n):
+        """Checkpoint early if only deferred frees can cover an n-block allocation."""
+        if self._free_count < n and self._pending_free:
+            self._save_state()
+
     def _allocate_blocks(self, n):
-        """Allocate n free blocks and link them in the FAT."""
-        free_indices = [i for i, ok in enumerate(self.free_map) if ok]
-        if len(free_indices) < n:
+        """Allocate n free blocks, contiguous when possible, and link them in the FAT."""
+        self._reclaim_pending(n)
+        if self._free_count < n:
             return None
 
-        allocated = free_indices[:n]
+        fat = self.fat
+        allocated = self._find_free_run(n)
+        # a first-fit run may skip smaller holes, so the hint only moves
+        # if the run started right at it; the n lowest free blocks always do
+        advance_hint = allocated is None or allocated[0] == self._next_free
+        if allocated is None:
+            allocated = self._find_free(n)  # no gap big enough: scatter
 
+        prev = -1
         for idx in allocated:
-            self.free_map[idx] = False
-            self.fat[idx] = -1
+            self._mark_used(idx)
+            if prev != -1:
+                fat[prev] = idx  # link while allocating
+            prev = idx
+        if prev != -1:
+            fat[prev] = -1
+            if advance_hint:
+                self._next_free = prev + 1  # everything up to here is now used
+
+        self._free_count -= n
+        return allocated
 
-        for i in range(len(allocated) - 1):
-            self.fat[allocated[i]] = allocated[i + 1]
+    def _allocate_one_block(self):
+        """Allocate a single free block as a one-block chain."""
+        self._reclaim_pending(1)
+        if not self._free_count:
+            return None
 
-        return allocated
+        idx = self._find_free(1)[0]
+        self._mark_used(idx)
+        self._next_free = idx + 1
+        self._free_count -= 1
+        self.fat[idx] = -1
+        return idx
 
-    def _extend_chain(self, first_block, num_new_blocks):
-        """Append blocks to an existing file chain."""
+    def _extend_chain(self, last_block, num_new_blocks):
+        """Append blocks after last_block (-1 for an empty file); return the new blocks."""
         new_blocks = self._allocate_blocks(num_new_blocks)
         if not new_blocks:
             return None
 
-        if first_block == -1:
-            return new_blocks[0]
+        if last_block != -1:
+            self.fat[last_block] = new_blocks[0]
+        return new_blocks
 
-        curr = first_block
-        while self.fat[curr] != -1:
-            curr = self.fat[curr]
+    def _claim_chain(self, chain):
+        """Mark the given blocks used and link them in order (journal replay)."""
+        fat = self.fat
+        claimed = 0
+        prev = -1
+        for b in chain:
+            if self._is_free(b):
+                self._mark_used(b)
+                claimed += 1
+            if prev != -1:
+                fat[prev] = b
+            prev = b
+        fat[prev] = -1
 
-        self.fat[curr] = new_blocks[0]
-        return first_block
+        self._free_count -= claimed
 
     def _get_block_chain(self, first_block):
         """Return a list of blocks for a file by following the FAT."""
+        fat = self.fat
         chain = []
+        append = chain.append
         b = first_block
-        while b != -1 and b != -2:
-            chain.append(b)
-            b = self.fat[b]
+        while b >= 0:  # stops at -1 (EOF) or -2 (free)
+            append(b)
+            b = fat[b]
         return chain
 
+    def _contiguous_runs(self, blocks):
+        """Group block indices into sorted [start, end) runs."""
+        runs = []
+        for b in sorted(blocks):
+            if runs and runs[-1][1] == b:
+                runs[-1][1] = b + 1
+            else:
+                runs.append([b, b + 1])
+        return runs
+
+    def _chain_runs(self, chain):
+        """Split a chain into (position, first_block, count) runs of adjacent blocks."""
+        runs = []
+        for pos, b in enumerate(chain):
+            if runs and runs[-1][1] + runs[-1][2] == b:
+                runs[-1][2] += 1
+            else:
+                runs.append([pos, b, 1])
+        return runs
+
     def _free_chain(self, first_block):
-        """Free all blocks used by a file."""
-        b = first_block
-        while b != -1:
-            nxt = self.fat[b]
-            self.free_map[b] = True
-            self.fat[b] = -2
-            self._write_block(b, b"")
-            b = nxt
+        """Free all blocks used by a file (deferred to the next checkpoint in batch mode)."""
+        chain = self._get_block_chain(first_block)
+        if self._batch_mode:
+            self._pending_free.extend(chain)  # nothing journals the free yet
+        else:
+            self._release_blocks(chain)
+
+    def _release_blocks(self, chain):
+        """Return blocks to the allocator."""
+        fat = self.fat
+        for b in chain:
+            fat[b] = -2
+            self._mark_free(b)
+        self._free_count += len(chain)
+        if chain:
+            self._next_free = min(self._next_free, min(chain))
+        # freed blocks keep their old bytes: write_file rewrites every block
+        # it hands out, and zeroing here would clobber newer data on replay
 
     def _write_block(self, block_index, data):
-        """Write one block worth of bytes into RAM."""
+        """Write one block worth of bytes into RAM (zero-padding a short tail)."""
         start = block_index * BLOCK_SIZE
-        block_data = data[:BLOCK_SIZE].ljust(BLOCK_SIZE, b"\x00")
-        self._disk_mem[start:start + BLOCK_SIZE] = block_data
+        block_end = start + BLOCK_SIZE
+        end = start + min(len(data), BLOCK_SIZE)
 
-    def _read_block(self, block_index):
-        """Read one block worth of bytes from RAM."""
-        start = block_index * BLOCK_SIZE
-        return bytes(self._disk_mem[start:start + BLOCK_SIZE])
+        self._mv[start:end] = data[:end - start]
+        if end < block_end:
+            self._mv[end:block_end] = _ZEROS[:block_end - end]
+        self._dirty_blocks.add(block_index)
 
     # ---------- user operations ----------
 
     def mkdir(self, dirname):
         """Create a new directory in the current directory."""
         parent = self._get_current_dir_node()
-        if dirname in parent["children"]:
+        if dirname in parent["dirs"] or dirname in parent["files"]:
             print(f"Error: '{dirname}' already exists.")
             return
 
-        parent["children"][dirname] = {
-            "name": dirname,
-            "type": "dir",
-            "children": {}
-        }
-        self._save_state()
+        parts = self.current_path + [dirname]
+        self._add_node(parent, parts, "dir")
+        self._log_op("mkdir", parts)
         print(f"Directory '{dirname}' created.")
 
     def cd(self, dirname):
@@ -257,19 +754,20 @@ class FileSystem:
         if dirname == "..":
             if self.current_path:
                 self.current_path.pop()
+                self._cwd_nodes.pop()
             return
 
         if dirname == "/":
             self.current_path = []
+            self._cwd_nodes = [self.root]
             return
 
         parent = self._get_current_dir_node()
-        if dirname in parent["children"]:
-            entry = parent["children"][dirname]
-            if entry["type"] == "dir":
-                self.current_path.append(dirname)
-            else:
-                print(f"Error: '{dirname}' is not a directory.")
+        if dirname in parent["dirs"]:
+            self.current_path.append(dirname)
+            self._cwd_nodes.append(parent["dirs"][dirname])
+        elif dirname in parent["files"]:
+            print(f"Error: '{dirname}' is not a directory.")
         else:
             print(f"Error: Directory '{dirname}' not found.")
 
@@ -278,45 +776,44 @@ class FileSystem:
         node = self._get_current_dir_node()
         path_str = "/" + "/".join(self.current_path)
         print(f"Contents of {path_str if path_str != '/' else '/'}:")
-        for name, entry in node["children"].items():
-            if entry["type"] == "dir":
-                print(f"  [DIR]  {name}")
-            else:
-                print(f"  [FILE] {name} (Size: {entry['size']})")
+        for name in node["dirs"]:
+            print(f"  [DIR]  {name}")
+        for name, entry in node["files"].items():
+            print(f"  [FILE] {name} (Size: {entry['size']})")
 
     def create_file(self, filename):
         """Create a new empty file."""
         parent = self._get_current_dir_node()
-        if filename in parent["children"]:
+        if filename in parent["files"] or filename in parent["dirs"]:
             print(f"Error: '{filename}' already exists.")
             return
 
-        parent["children"][filename] = {
-            "name": filename,
-            "type": "file",
-            "size": 0,
-            "first_block": -1
-        }
-        self._save_state()
+        parts = self.current_path + [filename]
+        self._add_node(parent, parts, "file")
+        self._log_op("create", parts)
         print(f"File '{filename}' created.")
 
     def open_file(self, filename):
         """Open a file so read/write are allowed."""
         parent = self._get_current_dir_node()
-        if filename not in parent["children"]:
-            print(f"Error: File '{filename}' not found.")
+        if filename not in parent["files"]:
+            if filename in parent["dirs"]:
+                print(f"Error: '{filename}' is a directory.")
+            else:
+                print(f"Error: File '{filename}' not found.")
             return
 
-        entry = parent["children"][filename]
-        if entry["type"] != "file":
-            print(f"Error: '{filename}' is a directory.")
-            return
+        entry = parent["files"][filename]
 
         if filename in self.open_file_table:
             print(f"File '{filename}' already open.")
             return
 
-        self.open_file_table[filename] = {"pos": 0, "node": entry}
+        self.open_file_table[filename] = {
+            "pos": 0,
+            "node": entry,
+            "parts": self.current_path + [filename],
+        }
         print(f"File '{filename}' opened.")
 
     def close_file(self, filename):
@@ -333,42 +830,71 @@ class FileSystem:
             print("Error: File not open.")
             return
 
-        entry = self.open_file_table[filename]["node"]
+        open_rec = self.open_file_table[filename]
+        entry = open_rec["node"]
         data_bytes = data.encode("utf-8")
         total_len = len(data_bytes)
 
-        blocks_needed = math.ceil(total_len / BLOCK_SIZE)
+        # batch mode journals nothing, so a rewrite goes to a fresh chain and
+        # the old one (possibly still checkpointed) is freed afterwards
+        old_first = entry["first_block"] if self._batch_mode else -1
+        first_block = -1 if self._batch_mode else entry["first_block"]
+
+        # fast path: first write of a file that fits in one block
+        if first_block == -1 and total_len <= BLOCK_SIZE:
+            blk = self._allocate_one_block()
+            if blk is None:
+                print("Error: Disk full.")
+                return
+            self._write_block(blk, data_bytes)
+            if old_first != -1:
+                self._free_chain(old_first)
+            entry["first_block"] = blk
+            entry["size"] = total_len
+            self._log_op("write", open_rec["parts"], total_len, [blk])
+            print(f"Wrote {total_len} bytes to '{filename}'.")
+            return
+
+        blocks_needed = (total_len + BLOCK_SIZE - 1) // BLOCK_SIZE
         if blocks_needed == 0:
             blocks_needed = 1
 
-        current_chain = self._get_block_chain(entry["first_block"])
+        current_chain = self._get_block_chain(first_block)
         current_count = len(current_chain)
+        new_blocks = []
 
         if blocks_needed > current_count:
             needed = blocks_needed - current_count
-            new_start = self._extend_chain(entry["first_block"], needed)
-            if new_start is None:
+            last_block = current_chain[-1] if current_chain else -1
+            new_blocks = self._extend_chain(last_block, needed)
+            if new_blocks is None:
                 print("Error: Disk full.")
                 return
-            if entry["first_block"] == -1:
-                entry["first_block"] = new_start
-            current_chain = self._get_block_chain(entry["first_block"])
-
-        offset = 0
-        remaining = total_len
-
-        for b in current_chain:
-            if remaining <= 0:
-                self._write_block(b, b"")
-                continue
-
-            chunk = data_bytes[offset: offset + BLOCK_SIZE]
-            self._write_block(b, chunk)
-            offset += len(chunk)
-            remaining -= len(chunk)
+            if first_block == -1:
+                if old_first != -1:
+                    self._free_chain(old_first)
+                entry["first_block"] = new_blocks[0]
+            current_chain.extend(new_blocks)
+
+        data_view = memoryview(data_bytes)  # zero-copy slices per run
+
+        # one copy per physically contiguous run of the chain, zero-filling
+        # whatever part of the run the new data doesn't reach
+        for pos, first, count in self._chain_runs(current_chain):
+            data_start = pos * BLOCK_SIZE
+            run_len = count * BLOCK_SIZE
+            disk_start = first * BLOCK_SIZE
+            n = max(0, min(run_len, total_len - data_start))
+
+            self._mv[disk_start:disk_start + n] = data_view[data_start:data_start + n]
+            if n < run_len:
+                self._mv[disk_start + n:disk_start + run_len] = _ZEROS[:run_len - n]
+            self._dirty_blocks.update(range(first, first + count))
 
         entry["size"] = total_len
-        self._save_state()
+        # only the appended blocks are journaled; an overwrite that fits the
+        # existing chain logs a constant-size record
+        self._log_op("write", open_rec["parts"], total_len, new_blocks)
         print(f"Wrote {total_len} bytes to '{filename}'.")
 
     def read_file(self, filename):
@@ -382,47 +908,46 @@ class FileSystem:
             print("")
             return
 
-        chain = self._get_block_chain(entry["first_block"])
-        bytes_to_read = entry["size"]
-        out = b""
+        size = entry["size"]
+        out = bytearray(size)
+        disk = self._mv
+        fat = self.fat
 
-        for b in chain:
-            if bytes_to_read <= 0:
-                break
-            chunk = self._read_block(b)
-            take = min(BLOCK_SIZE, bytes_to_read)
-            out += chunk[:take]
-            bytes_to_read -= take
+        # follow the FAT inline and stop once size bytes are copied; blocks
+        # kept past the end by an earlier, longer write are never visited
+        b = entry["first_block"]
+        for start in range(0, size, BLOCK_SIZE):
+            take = min(BLOCK_SIZE, size - start)
+            src = b * BLOCK_SIZE
+            out[start:start + take] = disk[src:src + take]
+            b = fat[b]
 
         print(out.decode("utf-8", errors="replace"))
 
     def delete_file(self, name):
         """Delete a file or an empty directory."""
         parent = self._get_current_dir_node()
-        if name not in parent["children"]:
+        if name not in parent["files"] and name not in parent["dirs"]:
             print("Not found.")
             return
 
-        entry = parent["children"][name]
-
-        if entry["type"] == "dir":
-            if entry["children"]:
-                print("Error: Directory not empty.")
-                return
-        else:
-            if entry["first_block"] != -1:
-                self._free_chain(entry["first_block"])
+        entry = parent["dirs"].get(name)
+        if entry is not None and (entry["dirs"] or entry["files"]):
+            print("Error: Directory not empty.")
+            return
 
-        parent["children"].pop(name, None)
+        parts = self.current_path + [name]
+        self._remove_node(parent, parts)
         self.open_file_table.pop(name, None)
 
-        self._save_state()
+        self._log_op("delete", parts)
         print(f"Deleted '{name}'.")
 
     def mv(self, src_path, dest_path):
         """Move or rename a file/directory."""
         src_parent, src_name = self._resolve_path(src_path)
-        if src_parent is None or src_name not in src_parent["children"]:
+        if src_parent is None or (src_name not in src_parent["files"]
+                                  and src_name not in src_parent["dirs"]):
             print(f"Error: Source '{src_path}' not found.")
             return
 
@@ -430,59 +955,53 @@ class FileSystem:
 
         target_dir = None
         target_name = None
+        target_parts = None
 
         if dest_parent is None and dest_name == "/":
             target_dir = self.root
             target_name = src_name
+            target_parts = []
         elif dest_parent is None and dest_name == ".":
             target_dir = self._get_current_dir_node()
             target_name = src_name
+            target_parts = list(self.current_path)
         elif dest_parent is not None:
-            if dest_name in dest_parent["children"]:
-                existing = dest_parent["children"][dest_name]
-                if existing["type"] == "dir":
-                    target_dir = existing
-                    target_name = src_name
-                else:
-                    print(f"Error: Destination '{dest_path}' already exists.")
-                    return
+            if dest_name in dest_parent["dirs"]:
+                target_dir = dest_parent["dirs"][dest_name]
+                target_name = src_name
+                target_parts = self._abs_parts(dest_path)
+            elif dest_name in dest_parent["files"]:
+                print(f"Error: Destination '{dest_path}' already exists.")
+                return
             else:
                 target_dir = dest_parent
                 target_name = dest_name
+                target_parts = self._abs_parts(dest_path)[:-1]
         else:
             print("Error: Invalid destination.")
             return
 
-        if target_name in target_dir["children"]:
+        if target_name in target_dir["dirs"] or target_name in target_dir["files"]:
             print(f"Error: Destination '{target_name}' already exists in target.")
             return
 
-        entry = src_parent["children"].pop(src_name)
-        entry["name"] = target_name
-        target_dir["children"][target_name] = entry
+        src_parts = self._abs_parts(src_path)
+        dest_parts = target_parts + [target_name]
+        if dest_parts[:len(src_parts)] == src_parts:
+            print(f"Error: Cannot move '{src_path}' into itself.")
+            return
+        self._move_node(src_parent, src_parts, target_dir, dest_parts)
 
         if src_name in self.open_file_table:
             del self.open_file_table[src_name]
             print(f"Note: '{src_name}' was open and got closed due to move/rename.")
 
-        self._save_state()
+        self._log_op("mv", src_parts, dest_parts)
         print(f"Moved '{src_path}' to '{target_name}'")
 
     def search_files(self, name):
         """Search the whole filesystem for a matching name."""
-        matches = []
-
-        def dfs(node, path_so_far):
-            if node["type"] != "dir":
-                return
-            for child_name, child in node["children"].items():
-                child_path = f"{path_so_far}/{child_name}" if path_so_far != "/" else f"/{child_name}"
-                if child_name == name:
-                    matches.append((child_path, child["type"]))
-                if child["type"] == "dir":
-                    dfs(child, child_path)
-
-        dfs(self.root, "/")
+        matches = self._name_index.get(name, [])
 
         if not matches:
             print(f"No matches found for '{name}'.")
@@ -492,56 +1011,72 @@ class FileSystem:
         for p, t in matches:
             print(f"  [{'FILE' if t == 'file' else 'DIR'}] {p}")
 
+    def sync(self):
+        """Checkpoint now instead of waiting for the next automatic save."""
+        self._flush_if_needed()
+        print("File system synced.")
+
 
 def main():
-    fs = FileSystem()
+    # piped scripts skip per-command journaling; a TTY session keeps it
+    fs = FileSystem(batch_mode=not sys.stdin.isatty())
     fs.init_filesystem()
 
     print("\nRAM-Disk File System")
-    print("Commands: mkdir, cd, ls, create, open, write, read, close, delete, mv, search, exit")
+    print("Commands: mkdir, cd, ls, create, open, write, read, close, delete, mv, search, sync, exit")
     print('Tip: Use quotes for write, e.g. write notes.txt "hello world"')
 
+    # command -> (handler, argument count); write takes variable text, and
+    # commands without arguments (ls, sync, exit) ignore any stray words
+    commands = {
+        "mkdir": (fs.mkdir, 1),
+        "cd": (fs.cd, 1),
+        "ls": (fs.ls, 0),
+        "create": (fs.create_file, 1),
+        "open": (fs.open_file, 1),
+        "close": (fs.close_file, 1),
+        "write": (fs.write_file, 2),
+        "read": (fs.read_file, 1),
+        "delete": (fs.delete_file, 1),
+        "mv": (fs.mv, 2),
+        "search": (fs.search_files, 1),
+        "sync": (fs.sync, 0),
+    }
+
     while True:
         try:
             prompt_path = "/" + "/".join(fs.current_path)
             raw = input(f"{prompt_path if prompt_path != '/' else '/'}> ").strip()
         except EOFError:
+            fs._flush_if_needed()
             break
 
         if not raw:
             continue
 
-        parts = raw.split()
-        cmd = parts[0].lower()
-
-        if cmd == "mkdir" and len(parts) == 2:
-            fs.mkdir(parts[1])
-        elif cmd == "cd" and len(parts) == 2:
-            fs.cd(parts[1])
-        elif cmd == "ls":
-            fs.ls()
-        elif cmd == "create" and len(parts) == 2:
-            fs.create_file(parts[1])
-        elif cmd == "open" and len(parts) == 2:
-            fs.open_file(parts[1])
-        elif cmd == "close" and len(parts) == 2:
-            fs.close_file(parts[1])
-        elif cmd == "write" and len(parts) >= 3:
-            filename = parts[1]
-            content = raw[raw.index(filename) + len(filename):].strip().strip('"')
-            fs.write_file(filename, content)
-        elif cmd == "read" and len(parts) == 2:
-            fs.read_file(parts[1])
-        elif cmd == "delete" and len(parts) == 2:
-            fs.delete_file(parts[1])
-        elif cmd == "mv" and len(parts) == 3:
-            fs.mv(parts[1], parts[2])
-        elif cmd == "search" and len(parts) == 2:
-            fs.search_files(parts[1])
-        elif cmd == "exit":
+        cmd = raw.split(None, 1)[0].lower()
+        if cmd == "exit":
             break
+
+        handler, nargs = commands.get(cmd, (None, None))
+        if handler is None:
+            print("Unknown command.")
+            continue
+        if cmd == "write":
+            # the text is kept as typed so quotes, backslashes and spacing survive
+            args = _split_command(raw, 2)[1:]
+            if len(args) < 2:
+                print("Usage error: write takes a file and text.")
+                continue
+            args[1] = _unquote_text(args[1])
         else:
-            print("Unknown command or wrong usage.")
+            args = _split_command(raw)[1:]
+            if not nargs:
+                args = []
+            elif len(args) != nargs:
+                print(f"Usage error: {cmd} takes {nargs} argument(s).")
+                continue
+        handler(*args)
 
     fs.shutdown()
     print("Goodbye!")